@@ -9,102 +9,273 @@ Usage:
 Results are saved as JSON in the output/ directory.
 """
 
-import json
+import hashlib
+import io
 import os
 import re
 import sys
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
+import langextract as lx
+import orjson
 import pymupdf
 from dotenv import load_dotenv
 
-from corates_ai.extraction import extract_study_metadata
+from corates_ai.extraction import extract_study_metadata_batch
 
 load_dotenv()
 
 PDFS_DIR = Path(__file__).resolve().parent.parent / "pdfs"
 OUTPUT_DIR = Path(__file__).resolve().parent.parent / "output"
-
+TEXT_CACHE_DIR = OUTPUT_DIR / ".text_cache"
+MAX_WORKERS = 4
+# Worker processes for PDF and page-level parallelism, capped by the CPU count
+NUM_WORKERS = min(os.cpu_count() or 1, MAX_WORKERS)
+# Concurrent LLM requests across all PDFs in the batch
+LLM_CONCURRENCY = 8
+# PDFs per LangExtract call; results are cached after each group completes
+BATCH_SIZE = 8
+# Below this many pages per worker, process startup outweighs the parallel speedup
+MIN_PAGES_PER_WORKER = 25
+
+
+# Headings that start the trailing section we strip. They're matched as whole
+# lines, so one compiled alternation stays a single linear scan as this grows.
+_REFERENCES_HEADINGS = ("References", "Bibliography", "Works Cited", "Literature Cited")
 
 _REFERENCES_PATTERN = re.compile(
-    r"^\s*(References|Bibliography|Works Cited|Literature Cited)\s*$",
+    r"^[ \t]*(?:" + "|".join(map(re.escape, _REFERENCES_HEADINGS)) + r")[ \t]*$",
     re.MULTILINE | re.IGNORECASE,
 )
 
+_WORD_RE = re.compile(r"\S+")
+
+# Cheap precheck before paying for an LLM call: real papers have a few hundred
+# words and one of these section headings near the start
+MIN_WORD_COUNT = 500
+_PAPER_MARKER_PATTERN = re.compile(
+    r"\b(Abstract|Background|Introduction|Methods?)\b", re.IGNORECASE
+)
 
-def extract_text_from_pdf(pdf_path: str | Path) -> str:
-    """Extract body text from a PDF, stripping the references section."""
+# Plain text is all the LLM needs: drop the default ligature and whitespace
+# preservation, but keep clipping to the page so off-page text stays out
+_TEXT_FLAGS = pymupdf.TEXT_MEDIABOX_CLIP
+
+
+def _read_pages(doc: pymupdf.Document, start: int, stop: int) -> tuple[str, bool]:
+    """Read pages [start, stop) of an open document into one string.
+
+    Stops at the first references heading, dropping it and everything after.
+    Returns the text and whether the heading was found.
+    """
+    buf = io.StringIO()
+    for i in range(start, stop):
+        if i > start:
+            buf.write("\n")
+        page_text = doc[i].get_text("text", flags=_TEXT_FLAGS)
+        match = _REFERENCES_PATTERN.search(page_text)
+        if match:
+            buf.write(page_text[: match.start()])
+            return buf.getvalue(), True
+        buf.write(page_text)
+    return buf.getvalue(), False
+
+
+def _extract_page_range(args: tuple[str, int, int]) -> tuple[str, bool]:
+    """Extract text from a contiguous range of pages in a worker process."""
+    pdf_path, start, stop = args
     doc = pymupdf.open(pdf_path)
-    pages = []
-    for page in doc:
-        pages.append(page.get_text())
+    result = _read_pages(doc, start, stop)
     doc.close()
-    text = "\n".join(pages)
+    return result
+
+
+def _text_cache_path(pdf_path: Path) -> Path:
+    """Cache file for a PDF's text.
+
+    Changing the PDF (mtime or size), the references headings or the text
+    flags gives a new path. Old entries are never pruned; delete
+    output/.text_cache to clear them.
+    """
+    stat = pdf_path.stat()
+    digest = hashlib.sha1(str(pdf_path.resolve()).encode()).hexdigest()
+    settings = hashlib.sha1(repr((_REFERENCES_HEADINGS, _TEXT_FLAGS)).encode()).hexdigest()[:8]
+    return TEXT_CACHE_DIR / f"{digest}_{stat.st_mtime_ns}_{stat.st_size}_{settings}.txt"
+
+
+def extract_text_from_pdf(
+    pdf_path: str | Path,
+    num_workers: int = NUM_WORKERS,
+) -> str:
+    """Extract body text from a PDF, stripping the references section.
+
+    Text is cached on disk, so unchanged PDFs are only parsed once.
+    """
+    cache_path = _text_cache_path(Path(pdf_path))
+    if cache_path.exists():
+        return cache_path.read_text(encoding="utf-8")
+
+    text = _extract_text(pdf_path, num_workers)
+    TEXT_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp_path = cache_path.with_suffix(".txt.tmp")
+    tmp_path.write_text(text, encoding="utf-8")
+    os.replace(tmp_path, cache_path)
+    return text
 
-    match = _REFERENCES_PATTERN.search(text)
-    if match:
-        text = text[: match.start()]
 
-    return text
+def _extract_text(pdf_path: str | Path, num_workers: int) -> str:
+    """Read a PDF's body text with PyMuPDF.
 
+    Pages after the references heading are never read. Large PDFs are split
+    into one contiguous page range per worker, each opening its own copy of
+    the document (PyMuPDF documents can't be shared across threads or
+    processes).
+    """
+    doc = pymupdf.open(pdf_path)
+    page_count = doc.page_count
+    if num_workers <= 1 or page_count < MIN_PAGES_PER_WORKER * 2:
+        text, _ = _read_pages(doc, 0, page_count)
+        doc.close()
+        return text
 
-def extractions_to_dicts(result) -> list[dict]:
-    """Convert LangExtract result into a list of plain dicts."""
-    if hasattr(result, "__iter__"):
-        documents = list(result)
-    else:
-        documents = [result]
+    doc.close()
+    num_workers = min(num_workers, page_count // MIN_PAGES_PER_WORKER)
+    bounds = [page_count * i // num_workers for i in range(num_workers + 1)]
+    ranges = [(str(pdf_path), start, stop) for start, stop in zip(bounds, bounds[1:])]
+    buf = io.StringIO()
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        # Segments come back in page order; anything after the first segment
+        # that hit the references heading is discarded
+        for i, (segment, found) in enumerate(executor.map(_extract_page_range, ranges)):
+            if i:
+                buf.write("\n")
+            buf.write(segment)
+            if found:
+                break
+    return buf.getvalue()
+
+
+def iter_extractions(
+    result: lx.data.AnnotatedDocument | Iterable[lx.data.AnnotatedDocument],
+) -> Iterator[dict]:
+    """Yield each extraction in a LangExtract result as a plain dict."""
+    documents = [result] if isinstance(result, lx.data.AnnotatedDocument) else result
 
-    entries = []
     for doc in documents:
-        if not hasattr(doc, "extractions"):
-            continue
-        for ext in doc.extractions:
-            entries.append({
+        for ext in doc.extractions or []:
+            yield {
                 "class": ext.extraction_class,
                 "text": ext.extraction_text,
                 "attributes": dict(ext.attributes) if ext.attributes else {},
-            })
-    return entries
-
-
-def process_pdf(pdf_path: Path):
-    """Extract text from a PDF and run study metadata extraction."""
-    print(f"Processing: {pdf_path.name}")
-    print("=" * 60)
-
-    text = extract_text_from_pdf(pdf_path)
-    word_count = len(text.split())
-    print(f"Extracted {word_count} words from {len(text)} characters")
+            }
+
+
+def looks_like_research_paper(text: str, word_count: int) -> bool:
+    """Heuristically check that extracted text is worth sending to the LLM."""
+    return word_count >= MIN_WORD_COUNT and bool(
+        _PAPER_MARKER_PATTERN.search(text, 0, 5000)
+    )
+
+
+def load_pdf(pdf_path: str, num_workers: int = 1) -> tuple[str, str | None]:
+    """Extract text from a PDF and report its size.
+
+    Runs inside a worker process, so only the path string is sent in and
+    (name, text) comes back, with text None if the PDF can't be read or
+    doesn't look like a research paper. num_workers controls page-level
+    parallelism and should stay at 1 when PDFs are already being loaded in
+    parallel.
+    """
+    pdf_path = Path(pdf_path)
+    try:
+        text = extract_text_from_pdf(pdf_path, num_workers=num_workers)
+    except Exception as e:
+        # One corrupt or encrypted PDF shouldn't abort the rest of the run
+        print(f"{pdf_path.name}: skipping, could not read PDF: {e}")
+        return pdf_path.name, None
+    word_count = sum(1 for _ in _WORD_RE.finditer(text))
+    print(f"{pdf_path.name}: extracted {word_count} words from {len(text)} characters")
+    if not looks_like_research_paper(text, word_count):
+        print(f"{pdf_path.name}: skipping, doesn't look like a research paper")
+        return pdf_path.name, None
+    return pdf_path.name, text
+
+
+def process_pdfs(pdf_paths: list[Path]):
+    """Extract text from PDFs and run study metadata extraction in batches."""
+    if len(pdf_paths) == 1:
+        loaded = [load_pdf(str(pdf_paths[0]), num_workers=NUM_WORKERS)]
+    else:
+        # Each PDF is independent; PyMuPDF is not thread-safe, so use processes
+        with ProcessPoolExecutor(max_workers=NUM_WORKERS) as executor:
+            loaded = list(executor.map(load_pdf, [str(p) for p in pdf_paths]))
     print()
 
-    preview = text[:500].strip()
-    print(f"Text preview:\n{preview}")
-    print("...")
-    print()
+    papers = [(name, text) for name, text in loaded if text is not None]
+    if not papers:
+        print("No research papers to extract from.")
+        return
 
     print("Running LangExtract...")
     print("-" * 60)
 
-    result = extract_study_metadata(text)
-    entries = extractions_to_dicts(result)
+    # Extract in bounded groups so results are cached and written as each
+    # group finishes, and one failed LLM call only loses its own group
+    failed = []
+    for start in range(0, len(papers), BATCH_SIZE):
+        group = papers[start : start + BATCH_SIZE]
+        try:
+            results = extract_study_metadata_batch(
+                [text for _, text in group],
+                cache_dir=OUTPUT_DIR / ".cache",
+                max_workers=LLM_CONCURRENCY,
+            )
+        except Exception as e:
+            print(f"Extraction failed for {len(group)} PDF(s): {e}")
+            print()
+            failed.extend(name for name, _ in group)
+            continue
+        for (name, _), result in zip(group, results):
+            write_output(name, iter_extractions(result))
+
+    if failed:
+        print(f"Extraction failed for: {', '.join(failed)}")
+        print("Re-run to retry them; completed PDFs are served from the cache.")
 
-    if entries:
+
+def write_output(name: str, entries: Iterable[dict]):
+    """Print extractions for one PDF and stream them to a JSON file."""
+    print(f"Results for: {name}")
+    print("=" * 60)
+
+    OUTPUT_DIR.mkdir(exist_ok=True)
+    out_name = Path(name).stem + ".json"
+    out_path = OUTPUT_DIR / out_name
+    # Write to a temp file and rename, so readers never see a partial file
+    tmp_path = out_path.with_suffix(".json.tmp")
+    count = 0
+    with open(tmp_path, "wb") as f:
+        f.write(b'{\n  "source": ' + orjson.dumps(name) + b',\n  "extractions": [')
         for entry in entries:
+            f.write(b",\n    " if count else b"\n    ")
+            # Nest each indented entry under "extractions"; newlines inside
+            # strings are escaped, so only layout lines get shifted
+            encoded = orjson.dumps(entry, option=orjson.OPT_INDENT_2)
+            f.write(encoded.replace(b"\n", b"\n    "))
+            count += 1
+
             print(f"[{entry['class']}]")
             print(f"  Text: {entry['text']}")
             for key, value in entry["attributes"].items():
                 print(f"  {key}: {value}")
             print()
-    else:
-        print("No extractions found.")
+        f.write(b"\n  ]\n}\n" if count else b"]\n}\n")
+    os.replace(tmp_path, out_path)
 
-    # Save JSON output
-    OUTPUT_DIR.mkdir(exist_ok=True)
-    out_name = pdf_path.stem + ".json"
-    out_path = OUTPUT_DIR / out_name
-    with open(out_path, "w") as f:
-        json.dump({"source": pdf_path.name, "extractions": entries}, f, indent=2)
+    if not count:
+        print("No extractions found.")
     print(f"Results saved to {out_path}")
     print()
 
@@ -121,7 +292,7 @@ def main():
         if not pdf_path.exists():
             print(f"Error: File not found: {pdf_path}")
             return
-        process_pdf(pdf_path)
+        process_pdfs([pdf_path])
         return
 
     if not PDFS_DIR.exists():
@@ -137,8 +308,7 @@ def main():
     print(f"Found {len(pdf_files)} PDF(s)")
     print()
 
-    for pdf_path in pdf_files:
-        process_pdf(pdf_path)
+    process_pdfs(pdf_files)
 
 
 if __name__ == "__main__":
@@ -55,21 +55,13 @@ def main():
 
     result = extract_study_metadata(SAMPLE_ABSTRACT)
 
-    if hasattr(result, "__iter__"):
-        documents = list(result)
-    else:
-        documents = [result]
-
-    for doc in documents:
-        if not hasattr(doc, "extractions"):
-            continue
-        for extraction in doc.extractions:
-            print(f"[{extraction.extraction_class}]")
-            print(f"  Text: {extraction.extraction_text}")
-            if extraction.attributes:
-                for key, value in extraction.attributes.items():
-                    print(f"  {key}: {value}")
-            print()
+    for extraction in result.extractions or []:
+        print(f"[{extraction.extraction_class}]")
+        print(f"  Text: {extraction.extraction_text}")
+        if extraction.attributes:
+            for key, value in extraction.attributes.items():
+                print(f"  {key}: {value}")
+        print()
 
 
 if __name__ == "__main__":
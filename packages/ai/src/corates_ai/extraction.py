@@ -1,10 +1,31 @@
 """Study metadata extraction from research paper text using LangExtract."""
 
+import dataclasses
+import functools
+import hashlib
+import json
 import os
+from pathlib import Path
 
 import langextract as lx
+from langextract import prompt_validation as pv
 
 
+# Start with the cheaper model and only escalate when it misses one of the
+# fields every paper should have
+DEFAULT_MODEL_ID = "gemini-2.5-flash-lite"
+FALLBACK_MODEL_ID = "gemini-2.5-flash"
+REQUIRED_CLASSES = ("title", "authors", "sample_size")
+
+# LangExtract's own default; keep concurrent requests within Gemini rate limits
+DEFAULT_MAX_WORKERS = 10
+
+# LangExtract renders each request as prompt, then examples, then the chunk
+# text. The prompt plus examples (~500 tokens) is currently below Gemini's
+# 1024-token minimum for implicit context caching, so nothing is cached yet.
+# Keep the prefix byte-identical across calls so it qualifies if the examples
+# grow: don't pass a per-paper additional_context, which is spliced in ahead
+# of the examples.
 STUDY_EXTRACTION_PROMPT = (
     "Extract study metadata from the research paper text. "
     "Identify the study title, authors, study design, sample size, "
@@ -65,10 +86,111 @@ STUDY_EXTRACTION_EXAMPLES = [
 ]
 
 
+@functools.cache
+def _prompt_digest() -> str:
+    """Hash the prompt and examples, so editing either invalidates the cache."""
+    examples = [
+        dataclasses.asdict(example, dict_factory=lx.data_lib.enum_asdict_factory)
+        for example in STUDY_EXTRACTION_EXAMPLES
+    ]
+    payload = json.dumps([STUDY_EXTRACTION_PROMPT, examples], sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _cache_key(model_ids: tuple[str, ...], text: str) -> str:
+    """Key a cached extraction by prompt, examples, models and input text."""
+    payload = f"{_prompt_digest()}|{'|'.join(model_ids)}|{text}"
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _load_cached(cache_dir: Path, key: str) -> lx.data.AnnotatedDocument | None:
+    """Return a previously cached extraction, or None on a cache miss."""
+    path = cache_dir / f"{key}.json"
+    if not path.exists():
+        return None
+    with open(path) as f:
+        return lx.data_lib.dict_to_annotated_document(json.load(f))
+
+
+def _store_cached(cache_dir: Path, key: str, result: lx.data.AnnotatedDocument):
+    """Save an extraction so identical requests can skip the LLM call."""
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    path = cache_dir / f"{key}.json"
+    # Rename into place so an interrupted write never leaves a bad cache entry
+    tmp_path = path.with_suffix(".json.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(lx.data_lib.annotated_document_to_dict(result), f)
+    os.replace(tmp_path, path)
+
+
+def _missing_required(result: lx.data.AnnotatedDocument) -> bool:
+    """Check whether an extraction lacks any of the REQUIRED_CLASSES."""
+    found = {ext.extraction_class for ext in result.extractions or []}
+    return not found.issuperset(REQUIRED_CLASSES)
+
+
+@functools.cache
+def _validate_examples():
+    """Check once per process that the examples align with their own text.
+
+    lx.extract repeats this alignment pass on every call by default even
+    though the examples never change, so it runs once here and is switched
+    off in the lx.extract call itself.
+    """
+    report = pv.validate_prompt_alignment(examples=STUDY_EXTRACTION_EXAMPLES)
+    pv.handle_alignment_report(report, level=pv.PromptValidationLevel.WARNING)
+
+
+@functools.cache
+def _get_model(model_id: str, api_key: str | None, max_workers: int):
+    """Build a language model once per configuration and reuse it.
+
+    lx.extract otherwise constructs a new provider, and with it a new Gemini
+    client and connection pool, on every call. The schema derived from the
+    examples is built here once as well.
+    """
+    provider_kwargs = {"api_key": api_key, "max_workers": max_workers}
+    config = lx.factory.ModelConfig(
+        model_id=model_id,
+        provider_kwargs={k: v for k, v in provider_kwargs.items() if v is not None},
+    )
+    return lx.factory.create_model(
+        config=config,
+        examples=STUDY_EXTRACTION_EXAMPLES,
+        use_schema_constraints=True,
+    )
+
+
+def _run_extraction(
+    text_or_documents, model_id: str, api_key: str | None, max_workers: int
+):
+    """Run LangExtract with the study metadata prompt and examples.
+
+    LangExtract sends each batch of chunks as concurrent requests, so
+    max_workers caps how many LLM calls are in flight at once. batch_length
+    matches it so every batch fills the worker pool.
+    """
+    _validate_examples()
+    return lx.extract(
+        text_or_documents=text_or_documents,
+        prompt_description=STUDY_EXTRACTION_PROMPT,
+        examples=STUDY_EXTRACTION_EXAMPLES,
+        model=_get_model(model_id, api_key, max_workers),
+        # Schema constraints are already applied to the prebuilt model
+        use_schema_constraints=False,
+        batch_length=max_workers,
+        max_workers=max_workers,
+        prompt_validation_level=pv.PromptValidationLevel.OFF,
+    )
+
+
 def extract_study_metadata(
     text: str,
-    model_id: str = "gemini-2.5-flash",
+    model_id: str = DEFAULT_MODEL_ID,
     api_key: str | None = None,
+    cache_dir: Path | None = None,
+    fallback_model_id: str | None = FALLBACK_MODEL_ID,
+    max_workers: int = DEFAULT_MAX_WORKERS,
 ) -> lx.data.AnnotatedDocument:
     """Extract structured study metadata from research paper text.
 
@@ -76,18 +198,101 @@ def extract_study_metadata(
         text: The research paper text to extract from.
         model_id: The LLM model to use for extraction.
         api_key: Google AI API key. Falls back to GOOGLE_API_KEY env var.
+        cache_dir: Optional directory for caching results by prompt, examples,
+            model and text. Repeat calls with the same input are served from
+            disk.
+        fallback_model_id: Model to retry with if the result is missing any
+            of the REQUIRED_CLASSES. Pass None to disable the retry.
+        max_workers: Maximum number of concurrent LLM requests.
 
     Returns:
         An AnnotatedDocument containing the extracted study metadata.
     """
+    if cache_dir is not None:
+        key = _cache_key((model_id, str(fallback_model_id)), text)
+        cached = _load_cached(cache_dir, key)
+        if cached is not None:
+            return cached
+
     if api_key is None:
         api_key = os.environ.get("GOOGLE_API_KEY")
 
-    result = lx.extract(
-        text_or_documents=text,
-        prompt_description=STUDY_EXTRACTION_PROMPT,
-        examples=STUDY_EXTRACTION_EXAMPLES,
-        model_id=model_id,
-        api_key=api_key,
-    )
+    result = _run_extraction(text, model_id, api_key, max_workers)
+    if fallback_model_id and _missing_required(result):
+        result = _run_extraction(text, fallback_model_id, api_key, max_workers)
+
+    if cache_dir is not None:
+        _store_cached(cache_dir, key, result)
     return result
+
+
+def extract_study_metadata_batch(
+    texts: list[str],
+    model_id: str = DEFAULT_MODEL_ID,
+    api_key: str | None = None,
+    cache_dir: Path | None = None,
+    fallback_model_id: str | None = FALLBACK_MODEL_ID,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+) -> list[lx.data.AnnotatedDocument]:
+    """Extract structured study metadata from several papers in one call.
+
+    Chunks from all papers are batched together by LangExtract, so N papers
+    share inference batches instead of making N separate extraction runs.
+    Identical texts (e.g. the same paper saved twice) are extracted once.
+
+    Args:
+        texts: The research paper texts to extract from.
+        model_id: The LLM model to use for extraction.
+        api_key: Google AI API key. Falls back to GOOGLE_API_KEY env var.
+        cache_dir: Optional directory for caching results by prompt, examples,
+            model and text. Only texts without a cached result are sent to
+            the model.
+        fallback_model_id: Model to retry with for any paper whose result is
+            missing one of the REQUIRED_CLASSES. Pass None to disable.
+        max_workers: Maximum number of concurrent LLM requests, shared
+            across all papers in the batch.
+
+    Returns:
+        One AnnotatedDocument per input text, in the same order as texts.
+    """
+    results: list[lx.data.AnnotatedDocument | None] = [None] * len(texts)
+    keys = [_cache_key((model_id, str(fallback_model_id)), text) for text in texts]
+    if cache_dir is not None:
+        for i, key in enumerate(keys):
+            results[i] = _load_cached(cache_dir, key)
+
+    # Send each distinct uncached text once; duplicates share its result
+    first_index: dict[str, int] = {}
+    for i, result in enumerate(results):
+        if result is None:
+            first_index.setdefault(keys[i], i)
+    misses = list(first_index.values())
+    if not misses:
+        return results
+
+    if api_key is None:
+        api_key = os.environ.get("GOOGLE_API_KEY")
+
+    documents = [
+        lx.data.Document(text=texts[i], document_id=f"doc_{i}") for i in misses
+    ]
+    extracted = _run_extraction(documents, model_id, api_key, max_workers)
+
+    # Retry only the papers the cheaper model couldn't fully handle
+    retry = [j for j, result in enumerate(extracted) if _missing_required(result)]
+    if fallback_model_id and retry:
+        retried = _run_extraction(
+            [documents[j] for j in retry], fallback_model_id, api_key, max_workers
+        )
+        for j, result in zip(retry, retried):
+            extracted[j] = result
+
+    extracted_by_key = {}
+    for i, result in zip(misses, extracted):
+        extracted_by_key[keys[i]] = result
+        if cache_dir is not None:
+            _store_cached(cache_dir, keys[i], result)
+    return [
+        result if result is not None else extracted_by_key[key]
+        for result, key in zip(results, keys)
+    ]